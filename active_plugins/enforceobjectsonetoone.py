@@ -1,4 +1,5 @@
 import numpy
+import scipy.sparse
 import cellprofiler_core.object
 from cellprofiler_core.constants.measurement import (
     C_PARENT,
@@ -6,6 +7,8 @@ from cellprofiler_core.constants.measurement import (
     C_COUNT,
     C_LOCATION,
     C_NUMBER,
+    FF_CHILDREN_COUNT,
+    FF_PARENT,
     FTR_CENTER_X,
     FTR_CENTER_Y,
     FTR_CENTER_Z,
@@ -65,6 +68,51 @@ Measurements made by this module
 )
 
 
+def match_primaries(hist, out):
+    """Match each primary object to at most one secondary object
+
+    hist - sparse overlap histogram, primary labels on the rows and secondary labels on the columns
+    out - array indexed by primary label, filled in with the matched secondary label (0 if none)
+    """
+    out[:] = 0
+    # work only on the (nucleus, cell) pairs that actually overlap, ignoring the background
+    overlap = hist.tocoo()
+    touching = (overlap.row > 0) & (overlap.col > 0) & (overlap.data > 0)
+    primary = overlap.row[touching]
+    secondary = overlap.col[touching]
+    area = overlap.data[touching]
+    if area.shape[0] == 0:
+        return
+    # if every nucleus touches one cell and every cell one nucleus, they already are 1:1
+    if (
+        numpy.bincount(primary).max() == 1
+        and numpy.bincount(secondary).max() == 1
+    ):
+        out[primary] = secondary
+        return
+    # what fraction of each nucleus' area (inside any cell) is in each cell
+    primary_area = numpy.bincount(primary, weights=area, minlength=hist.shape[0])
+    percent_overlap = area / primary_area[primary]
+    # for each cell, the nuclei with the best percent overlap
+    best_primary_score = numpy.zeros((hist.shape[1],))
+    numpy.maximum.at(best_primary_score, secondary, percent_overlap)
+    best_primary = percent_overlap == best_primary_score[secondary]
+    # if several nuclei tie, pick the nucleus with the most area inside the cell
+    best_tiebreaker_score = numpy.zeros((hist.shape[1],), area.dtype)
+    numpy.maximum.at(best_tiebreaker_score, secondary, numpy.where(best_primary, area, 0))
+    best_tiebreaker = best_primary & (area == best_tiebreaker_score[secondary])
+    # if there is still a tie, everyone loses (because otherwise 1:1 might die)
+    winners_per_secondary = numpy.bincount(secondary[best_tiebreaker], minlength=hist.shape[1])
+    won = best_tiebreaker & (winners_per_secondary[secondary] == 1)
+    # each nucleus takes the cell it touches the most out of the ones it won, lowest label first on ties
+    won_primary, won_secondary, won_area = primary[won], secondary[won], area[won]
+    order = numpy.lexsort((won_secondary, -won_area, won_primary))
+    won_primary, won_secondary = won_primary[order], won_secondary[order]
+    first = numpy.ones(won_primary.shape, bool)
+    first[1:] = won_primary[1:] != won_primary[:-1]
+    out[won_primary[first]] = won_secondary[first]
+
+
 class EnforceObjectsOneToOne(ObjectProcessing):
     module_name = "EnforceObjectsOneToOne"
 
@@ -164,18 +212,43 @@ class EnforceObjectsOneToOne(ObjectProcessing):
         
         pre_primary = workspace.object_set.get_objects(self.x_name.value)
 
-        pre_primary_seg = pre_primary.segmented
+        # 32 bits is plenty for object labels, and every pass over the label images below is memory-bound,
+        # so get contiguous int32 arrays once (no copy if they already are)
+        pre_primary_seg = numpy.ascontiguousarray(pre_primary.segmented, dtype=numpy.int32)
 
         pre_secondary = workspace.object_set.get_objects(self.y_name.value)
 
-        pre_secondary_seg = pre_secondary.segmented
-
-        primary_seg = self.enforce_unique(pre_primary_seg, pre_secondary_seg, erode_excess=True)
+        pre_secondary_seg = numpy.ascontiguousarray(pre_secondary.segmented, dtype=numpy.int32)
+
+        hist = self.overlap_histogram(pre_primary_seg, pre_secondary_seg)
+
+        primary_seg, secondary_matches = self.enforce_unique(pre_primary_seg, pre_secondary_seg, erode_excess=True, hist=hist)
+
+        # the eroded primaries only overlap their matched secondary, so the second overlap histogram
+        # can be read off the first one instead of scanning the images again
+        matched_primaries = secondary_matches.nonzero()[0]
+        matched_secondaries = secondary_matches[matched_primaries]
+        matched_areas = numpy.zeros(matched_primaries.shape, hist.dtype)
+        if matched_primaries.shape[0] > 0:
+            matched_areas[:] = hist[matched_primaries, matched_secondaries]
+        swapped_hist = scipy.sparse.csr_matrix(
+            (
+                matched_areas,
+                (matched_secondaries, numpy.arange(1, matched_primaries.shape[0]+1)),
+            ),
+            shape=(hist.shape[1], matched_primaries.shape[0]+1),
+        )
 
-        secondary_seg = self.enforce_unique(pre_secondary_seg, primary_seg)
+        secondary_seg, primary_matches = self.enforce_unique(pre_secondary_seg, primary_seg, hist=swapped_hist)
 
-        if not numpy.array_equal(numpy.unique(primary_seg),numpy.unique(secondary_seg)):
-            raise RuntimeError(f"Something is wrong, there are {numpy.unique(primary_seg).shape[0]-1} primary objects (highest value: {numpy.unique(primary_seg)[-1]}) and {numpy.unique(secondary_seg).shape[0]-1} secondary objects (highest value: {numpy.unique(secondary_seg)[-1]})")
+        # both outputs are reindexed to 1..number of matches, so the label sets agree exactly when the
+        # match counts do; no need to scan the label images for that
+        matched_secondaries_in_order = primary_matches.nonzero()[0]
+        enforced_count = matched_primaries.shape[0]
+        if enforced_count != matched_secondaries_in_order.shape[0]:
+            primary_labels = numpy.unique(primary_seg)
+            secondary_labels = numpy.unique(secondary_seg)
+            raise RuntimeError(f"Something is wrong, there are {primary_labels.shape[0]-1} primary objects (highest value: {primary_labels[-1]}) and {secondary_labels.shape[0]-1} secondary objects (highest value: {secondary_labels[-1]})")
 
         new_primary_objects = cellprofiler_core.object.Objects()
         new_primary_objects.segmented = primary_seg
@@ -193,25 +266,40 @@ class EnforceObjectsOneToOne(ObjectProcessing):
 
         workspace.object_set.add_objects(new_secondary_objects, self.output_secondary_objects_name.value)
 
-        #relate old primary to new primary, and get the measurements
-        self.add_measurements(workspace,self.x_name.value, self.output_primary_objects_name.value)
+        #get the location, number and count measurements of the new objects
+        super(ObjectProcessing, self).add_measurements(workspace, self.output_primary_objects_name.value)
+        super(ObjectProcessing, self).add_measurements(workspace, self.output_secondary_objects_name.value)
+
+        # the matches already say which object each new object came from, so the parent/child measurements
+        # don't need relate_children to re-scan the label images
 
-        #relate old secondary to new secondary, and get the measurements
-        self.add_measurements(workspace,self.y_name.value, self.output_secondary_objects_name.value)
+        #relate old primary to new primary: new primaries are the matched pre-primaries, in label order
+        self.add_relationship_measurements(
+            workspace, self.x_name.value, self.output_primary_objects_name.value,
+            matched_primaries, hist.shape[0]-1
+        )
 
-        #relate new primary to new secondary, and get the measurements        
-        self.add_measurements(workspace,self.output_primary_objects_name.value, self.output_secondary_objects_name.value)
+        #relate old secondary to new secondary: new secondaries are the matched pre-secondaries, in label order
+        self.add_relationship_measurements(
+            workspace, self.y_name.value, self.output_secondary_objects_name.value,
+            matched_secondaries_in_order, hist.shape[1]-1
+        )
 
-        #make outline image
-    
-        if self.wants_display_outlines_on_image:
-            image_name = self.image_name.value
-            image = workspace.image_set.get_image(image_name, must_be_grayscale=True)
-            img = image.pixel_data
-        else:
-            img = numpy.zeros(pre_primary.shape, dtype = "uint8")
+        #relate new primary to new secondary: each new secondary's parent is the new primary it was matched to
+        self.add_relationship_measurements(
+            workspace, self.output_primary_objects_name.value, self.output_secondary_objects_name.value,
+            primary_matches[matched_secondaries_in_order], enforced_count
+        )
 
         if self.show_window:
+            #make outline image; the blank one is only needed for the display, so don't allocate it headless
+            if self.wants_display_outlines_on_image:
+                image_name = self.image_name.value
+                image = workspace.image_set.get_image(image_name, must_be_grayscale=True)
+                img = image.pixel_data
+            else:
+                img = numpy.zeros(pre_primary.shape, dtype = "uint8")
+
             workspace.display_data.pre_primary_labels = pre_primary.segmented
             workspace.display_data.pre_secondary_labels = pre_secondary.segmented
             workspace.display_data.primary_labels = new_primary_objects.segmented
@@ -219,9 +307,10 @@ class EnforceObjectsOneToOne(ObjectProcessing):
             workspace.display_data.dimensions = new_primary_objects.dimensions
             workspace.display_data.img = img
             statistics = workspace.display_data.statistics
-            statistics.append(["# of pre-primary objects", numpy.unique(pre_primary_seg).shape[0]-1])
-            statistics.append(["# of pre-secondary objects", numpy.unique(pre_secondary_seg).shape[0]-1])
-            statistics.append(["# of enforced objects", numpy.unique(primary_seg).shape[0]-1])
+            # count the labels present with one linear pass each rather than sorting the images
+            statistics.append(["# of pre-primary objects", numpy.count_nonzero(numpy.bincount(pre_primary_seg.ravel())[1:])])
+            statistics.append(["# of pre-secondary objects", numpy.count_nonzero(numpy.bincount(pre_secondary_seg.ravel())[1:])])
+            statistics.append(["# of enforced objects", enforced_count])
 
     def display(self, workspace, figure):
         
@@ -287,109 +376,78 @@ class EnforceObjectsOneToOne(ObjectProcessing):
             row_labels=[x[0] for x in workspace.display_data.statistics],            
         )
 
-    def enforce_unique(self, primary_object_array,secondary_object_array,erode_excess=False):
-        hist, _, _ = numpy.histogram2d(
-            primary_object_array.flatten(),
-            secondary_object_array.flatten(),
-            bins=[range(primary_object_array.max()+2),range(secondary_object_array.max()+2)]
+    def add_relationship_measurements(self, workspace, parent_name, child_name, parents_of_children, parent_count):
+        """Add the children count and parent measurements given the parent label of each child
+
+        This writes the same measurements as the relate_children step of ObjectProcessing.add_measurements
+        for children that each lie within a single parent.
+        """
+        parents_of_children = numpy.asarray(parents_of_children, int)
+        children_per_parent = numpy.bincount(parents_of_children, minlength=parent_count + 1)[1:]
+
+        workspace.measurements.add_measurement(
+            parent_name, FF_CHILDREN_COUNT % child_name, children_per_parent,
+        )
+
+        workspace.measurements.add_measurement(
+            child_name, FF_PARENT % parent_name, parents_of_children,
         )
-        sanity_check_list = []
-        # for each nucleus
-        primary_copy = primary_object_array.copy()
-        for primary in numpy.unique(primary_object_array)[1:]:
-            secondary_in_primary = hist[primary,:]
-            # if I don't touch any cells, nothing to do
-            if secondary_in_primary[1:].sum() == 0 :
-                secondary_match = 0
-            # if do I touch any cells
-            else:
-                # default assumption: I never find a cell buddy :( . Keeps us from having to write a bunch of else's that explicitly set this
-                secondary_match = 0
-                # what cells do I touch
-                secondaries_touched = list(secondary_in_primary[1:].nonzero()[0]+1)
-                
-                # let's figure out how much I touch them, with a lot of annoying complexity to account for ties
-                overlap_dict = {}
-                for each_secondary in secondaries_touched:
-                    overlap = hist[primary,each_secondary]
-                    if overlap not in overlap_dict.keys():
-                        overlap_dict[overlap]=[each_secondary]
-                    else:
-                        overlap_dict[overlap].append(each_secondary)
-                areas = list(overlap_dict.keys())
-                areas.sort(reverse=True)
-                order_to_try = []
-                for each_area in areas:
-                    order_to_try+=overlap_dict[each_area]
-
-                # now starting from the cell I touch the most, let's see if I am the best nucleus. Break if I ever am
-                for each_secondary in order_to_try:
-                    # what other nuclei touch this cell
-                    secondary_touchers = hist[1:,each_secondary].nonzero()[0]+1
-                    #if the cell I touch most only touches me, that's a match:
-                    if secondary_touchers.shape == 1:
-                        secondary_match = each_secondary
-                        break
-                    # if it's more than just me:
-                    else:
-                        # if multiple nuclei pick the same cell, pick the nucleus with the best percent overlap
-                        best_primary_score = 0
-                        best_primary = []
-                        for each_toucher in secondary_touchers:
-                            score = hist[each_toucher,each_secondary]/hist[each_toucher,1:].sum()
-                            if score > best_primary_score:
-                                best_primary_score = score
-                                best_primary = [each_toucher]
-                            elif score == best_primary_score:
-                                best_primary+=[each_toucher]
-                        # do I win?
-                        if best_primary == [primary]:
-                            secondary_match = each_secondary
-                            break
-                        # do I at least tie - if so, pick the nucleus with the most area inside the cell
-                        elif primary in best_primary:
-                            best_tiebreaker_score = 0
-                            best_tiebreaker = []
-                            for each_primary in best_primary:
-                                if hist[each_primary,each_secondary] > best_tiebreaker_score:
-                                    best_tiebreaker_score = hist[each_primary,each_secondary]
-                                    best_tiebreaker = [each_primary]
-                                elif hist[each_primary,each_secondary] == best_tiebreaker_score:
-                                    best_tiebreaker += [each_primary]
-                                # do I win outright? If a tie, everyone loses (because otherwise 1:1 might die)
-                            if best_tiebreaker == [primary]:
-                                # I win - otherwise, the default secondary_match of 0 still applies
-                                secondary_match = each_secondary
-                                break
-            if secondary_match != 0:
-                sanity_check_list.append(secondary_match)
-                if erode_excess:
-                    primary_copy = numpy.where((primary_object_array == primary) & (secondary_object_array != secondary_match), 0, primary_copy)
-            else:
-                primary_copy = numpy.where(primary_object_array == primary, 0, primary_copy)
+
+    def overlap_histogram(self, primary_object_array, secondary_object_array):
+        # only pixels labeled in both images can contribute an overlap, so skip the (often much larger)
+        # background rather than binning every pixel/voxel of the image
+        overlapping = (primary_object_array > 0) & (secondary_object_array > 0)
+        # most (primary, secondary) pairs never touch, so keep the counts sparse instead of allocating
+        # a dense primaries x secondaries table; duplicate pairs are summed when converting to CSR
+        hist = scipy.sparse.coo_matrix(
+            (
+                numpy.ones((numpy.count_nonzero(overlapping),), int),
+                (primary_object_array[overlapping], secondary_object_array[overlapping]),
+            ),
+            shape=(int(primary_object_array.max())+1, int(secondary_object_array.max())+1),
+        ).tocsr()
+        return hist
+
+    def enforce_unique(self, primary_object_array,secondary_object_array,erode_excess=False,hist=None):
+        if hist is None:
+            hist = self.overlap_histogram(primary_object_array, secondary_object_array)
+        # which cell each nucleus ended up matched to, 0 if none
+        secondary_matches = numpy.zeros((hist.shape[0],), numpy.int32)
+        match_primaries(hist, secondary_matches)
+        # erode or remove every nucleus in one pass: look up the cell each pixel's nucleus was matched to
+        matched_secondary = secondary_matches[primary_object_array]
+        keep = matched_secondary != 0
+        if erode_excess:
+            keep &= matched_secondary == secondary_object_array
+        # the lookup image is not needed after this, so write the kept labels straight into it
+        primary_copy = numpy.multiply(primary_object_array, keep, out=matched_secondary, casting="unsafe")
+
+        # how many nuclei were matched to each cell
+        match_counts = numpy.bincount(secondary_matches[secondary_matches != 0], minlength=hist.shape[1])
 
         # One last sanity check - are we ever linking two different primaries to the same secondary?
-        _, matched_to_count = numpy.unique(numpy.array(sanity_check_list),return_counts = True)
-        if matched_to_count.max() >1:
-            print(f"Maximum time any secondary object was matched to: {matched_to_count.max()}.")
+        if match_counts.max() >1:
+            print(f"Maximum time any secondary object was matched to: {match_counts.max()}.")
         
         # reindex the labels to be consecutive
         # mostly stolen from RelateObjects, which says it's mostly stolen from FilterObjects
-        indexes = numpy.unique(primary_copy)[1:]
+        # every matched nucleus keeps at least the pixels it shares with its cell, so these are the labels left
+        indexes = secondary_matches.nonzero()[0]
         # Create an array that maps label indexes to their new values
         # All labels to be deleted have a value in this array of zero
         new_object_count = len(indexes)
-        max_label = numpy.max(primary_copy)
-        label_indexes = numpy.zeros((max_label + 1,), int)
+        # primary_copy only holds labels from primary_object_array, whose highest label sized the histogram
+        max_label = hist.shape[0] - 1
+        label_indexes = numpy.zeros((max_label + 1,), primary_copy.dtype)
         label_indexes[indexes] = numpy.arange(1, new_object_count + 1)
 
         #
-        # Reindex the labels of the old source image
+        # Reindex the labels of the old source image in place; no label is above max_label,
+        # so "clip" never changes an index and spares take its buffered copy
         #
-        primary_copy[primary_copy > max_label] = 0
-        primary_copy = label_indexes[primary_copy]    
+        numpy.take(label_indexes, primary_copy, out=primary_copy, mode="clip")
     
-        return primary_copy
+        return primary_copy, secondary_matches
 
     def get_measurement_columns(self, pipeline):
          return super(EnforceObjectsOneToOne, self).get_measurement_columns(
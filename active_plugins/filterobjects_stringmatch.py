@@ -14,6 +14,7 @@ import numpy
 import scipy
 import scipy.ndimage
 import scipy.sparse
+import skimage.util
 
 import cellprofiler_core.object
 
@@ -26,6 +27,15 @@ METHOD_KEEP_CONTAINS = "Keep only strings containing"
 
 ADDITIONAL_STRING_SETTING_INDEX = 5
 
+
+def contains_string(values, string):
+    """Which of the strings in the array values contain string"""
+    # every string contains the empty string, so don't search for it
+    if string == "":
+        return numpy.ones(values.shape, bool)
+    return numpy.char.find(values, string) >= 0
+
+
 class FilterObjects_StringMatch(ObjectProcessing):
     module_name = "FilterObjects_StringMatch"
 
@@ -136,54 +146,53 @@ Click this button to add an additional string to apply to the objects with the s
         
         indexes = self.keep_by_string(workspace, src_objects)
 
+        new_object_count = len(indexes)
+        # read the labels once; every step below is a pass over the label image
+        src_segmented = src_objects.segmented
+        max_label = numpy.max(src_segmented)
         #
-        # Create an array that maps label indexes to their new values
-        # All labels to be deleted have a value in this array of zero
+        # Reindex the labels of the old source image: map label indexes to their
+        # new values, all labels to be deleted get a value of zero
         #
-        new_object_count = len(indexes)
-        max_label = numpy.max(src_objects.segmented)
-        label_indexes = numpy.zeros((max_label + 1,), int)
-        label_indexes[indexes] = numpy.arange(1, new_object_count + 1)
+        # a lookup table is sized by the highest label, so only use one when that
+        # is no bigger than the image; very sparse labels are mapped by hashing instead
+        if max_label < src_segmented.size:
+            label_indexes = numpy.zeros((max_label + 1,), int)
+            label_indexes[indexes] = numpy.arange(1, new_object_count + 1)
+            # max_label is the highest label in the image, so every label is a valid
+            # index and the lookup is a single gather, with no copy or clamping pass
+            target_labels = numpy.take(label_indexes, src_segmented)
+        else:
+            target_labels = skimage.util.map_array(
+                src_segmented, indexes, numpy.arange(1, new_object_count + 1)
+            )
         #
-        # Loop over both the primary and additional objects
+        # Make a new set of objects - retain the old set's unedited
+        # segmentation for the new and generally try to copy stuff
+        # from the old to the new.
         #
-        object_list = [(self.x_name.value, self.y_name.value)]
-        m = workspace.measurements
-        first_set = True
-        for src_name, target_name in object_list:
-            src_objects = workspace.get_objects(src_name)
-            target_labels = src_objects.segmented.copy()
-            #
-            # Reindex the labels of the old source image
-            #
-            target_labels[target_labels > max_label] = 0
-            target_labels = label_indexes[target_labels]
-            #
-            # Make a new set of objects - retain the old set's unedited
-            # segmentation for the new and generally try to copy stuff
-            # from the old to the new.
-            #
-            target_objects = cellprofiler_core.object.Objects()
-            target_objects.segmented = target_labels
-            target_objects.unedited_segmented = src_objects.unedited_segmented
-            #
-            # Remove the filtered objects from the small_removed_segmented
-            # if present. "small_removed_segmented" should really be
-            # "filtered_removed_segmented".
-            #
-            small_removed = src_objects.small_removed_segmented.copy()
-            small_removed[(target_labels == 0) & (src_objects.segmented != 0)] = 0
-            target_objects.small_removed_segmented = small_removed
-            if src_objects.has_parent_image:
-                target_objects.parent_image = src_objects.parent_image
-            workspace.object_set.add_objects(target_objects, target_name)
-
-            self.add_measurements(workspace, src_name, target_name)
-            if self.show_window and first_set:
-                workspace.display_data.src_objects_segmented = src_objects.segmented
-                workspace.display_data.target_objects_segmented = target_objects.segmented
-                workspace.display_data.dimensions = src_objects.dimensions
-                first_set = False
+        target_objects = cellprofiler_core.object.Objects()
+        target_objects.segmented = target_labels
+        target_objects.unedited_segmented = src_objects.unedited_segmented
+        #
+        # Remove the filtered objects from the small_removed_segmented
+        # if present. "small_removed_segmented" should really be
+        # "filtered_removed_segmented".
+        #
+        target_objects.small_removed_segmented = numpy.where(
+            (target_labels == 0) & (src_segmented != 0),
+            0,
+            src_objects.small_removed_segmented,
+        )
+        if src_objects.has_parent_image:
+            target_objects.parent_image = src_objects.parent_image
+        workspace.object_set.add_objects(target_objects, self.y_name.value)
+
+        self.add_measurements(workspace, self.x_name.value, self.y_name.value)
+        if self.show_window:
+            workspace.display_data.src_objects_segmented = src_segmented
+            workspace.display_data.target_objects_segmented = target_objects.segmented
+            workspace.display_data.dimensions = src_objects.dimensions
 
     def display(self, workspace, figure):
         """Display what was filtered"""
@@ -231,32 +240,37 @@ Click this button to add an additional string to apply to the objects with the s
         """
         src_name = self.x_name.value
         m = workspace.measurements
-        values = m.get_current_measurement(src_name, self.filter_column.value)
+        # compare the strings as a fixed-width array so each check is one pass in C
+        # rather than a Python loop over every object
+        values = numpy.asarray(
+            m.get_current_measurement(src_name, self.filter_column.value), dtype=str
+        )
+        if values.size == 0:
+            # no objects, nothing to check
+            return numpy.zeros((0,), int)
         # keep hits
         if self.filter_method == METHOD_EXACT:
-            hits = [self.filter_out.value != x for x in values]
-            if self.additional_strings:
-                for group in self.additional_strings:
-                    more_hits = [group.additional_string.value != x for x in values]
-                    hits = [a and b for a, b in zip(hits, more_hits)]
+            # look up all the strings to filter out in one pass over the values
+            hits = numpy.isin(
+                values,
+                [self.filter_out.value]
+                + [group.additional_string.value for group in self.additional_strings],
+                invert=True,
+            )
         elif self.filter_method == METHOD_KEEP_EXACT:
-            hits = [self.filter_out.value == x for x in values]
+            hits = values == self.filter_out.value
         elif self.filter_method == METHOD_CONTAINS:
-            hits = [self.filter_out.value not in x for x in values]
-            if self.additional_strings:
-                for group in self.additional_strings:
-                    more_hits = [group.additional_string.value not in x for x in values]
-                    hits = [a and b for a, b in zip(hits, more_hits)]
+            hits = ~contains_string(values, self.filter_out.value)
+            for group in self.additional_strings:
+                hits &= ~contains_string(values, group.additional_string.value)
         elif self.filter_method == METHOD_KEEP_CONTAINS:
-            hits = [self.filter_out.value in x for x in values]
-            if self.additional_strings:
-                for group in self.additional_strings:
-                    more_hits = [group.additional_string.value in x for x in values]
-                    hits = [a and b for a, b in zip(hits, more_hits)]
+            hits = contains_string(values, self.filter_out.value)
+            for group in self.additional_strings:
+                hits &= contains_string(values, group.additional_string.value)
         # Get object numbers for things that are True
-        indexes = numpy.argwhere(hits)[:, 0]
+        indexes = numpy.flatnonzero(hits)
         # Objects are 1 counted, Python is 0 counted
-        indexes = indexes + 1
+        indexes += 1
 
         return indexes
 
@@ -175,8 +175,8 @@ class HistogramEqualization(cellprofiler_core.module.ImageProcessing):
             clip_limit = self.clip_limit.value
 
             if self.do_3D.value:
-                y_data = numpy.zeros_like(x_data, dtype=float)
                 if self.do_framewise.value:
+                    y_data = numpy.zeros_like(x_data, dtype=numpy.float32)
                     for index, plane in enumerate(x_data):
                         y_data[index] = skimage.exposure.equalize_adapthist(
                             plane,
@@ -202,11 +202,14 @@ class HistogramEqualization(cellprofiler_core.module.ImageProcessing):
                 )
         else:
             if self.do_3D.value:
-                y_data = numpy.zeros_like(x_data, dtype=float)
                 if self.do_framewise.value:
+                    y_data = numpy.zeros_like(x_data, dtype=numpy.float32)
+                    # a volumetric mask has to be applied plane by plane too
+                    framewise_mask = mask_data is not None and mask_data.ndim == x_data.ndim
                     for index, plane in enumerate(x_data):
+                        plane_mask = mask_data[index] if framewise_mask else mask_data
                         y_data[index] = skimage.exposure.equalize_hist(
-                            plane, nbins=nbins, mask=mask_data
+                            plane, nbins=nbins, mask=plane_mask
                         )
                 else:
                     y_data = skimage.exposure.equalize_hist(
@@ -41,6 +41,26 @@ References
 """
 
 
+def reference_quantiles(reference):
+    """The distinct intensities of a reference image and the cumulative fraction of pixels at each"""
+    values, counts = numpy.unique(reference.ravel(), return_counts=True)
+    return values, numpy.cumsum(counts) / reference.size
+
+
+def match_quantiles(image, reference_values, reference_cdf):
+    """Match the histogram of image to a reference summarized by reference_cdf
+
+    This is what skimage.exposure.match_histograms does for a single channel, but the
+    reference only has to be summarized once when matching many planes to it.
+    """
+    values, lookup, counts = numpy.unique(
+        image.ravel(), return_inverse=True, return_counts=True
+    )
+    quantiles = numpy.cumsum(counts) / image.size
+    matched_values = numpy.interp(quantiles, reference_cdf, reference_values)
+    return matched_values[lookup.ravel()].reshape(image.shape)
+
+
 class HistogramMatching(cellprofiler_core.module.ImageProcessing):
     module_name = "HistogramMatching"
 
@@ -114,18 +134,17 @@ class HistogramMatching(cellprofiler_core.module.ImageProcessing):
         x_data = x.pixel_data
 
         if x.volumetric:
-            y_data = numpy.zeros_like(x_data, dtype=float)
+            y_data = numpy.zeros_like(x_data, dtype=numpy.float32)
 
             if self.do_self_reference.value:
                 reference_image = x_data[self.frame_number.value]
-                for index, plane in enumerate(x_data):
-                    y_data[index] = skimage.exposure.match_histograms(
-                        plane, reference_image
-                    )
             else:
-                reference_image = images.get_image(self.reference_image)
-                for index, plane in enumerate(x_data):
-                    y_data = skimage.exposure.match_histograms(plane, reference_image)
+                reference_image = images.get_image(self.reference_image).pixel_data
+
+            # every plane is matched to the same reference, so only summarize it once
+            reference_values, quantiles = reference_quantiles(reference_image)
+            for index, plane in enumerate(x_data):
+                y_data[index] = match_quantiles(plane, reference_values, quantiles)
         else:
             reference_image = images.get_image(self.reference_image).pixel_data
             y_data = skimage.exposure.match_histograms(x_data, reference_image)
@@ -0,0 +1,208 @@
+import cellprofiler_core.image
+import cellprofiler_core.measurement
+import cellprofiler_core.object
+import cellprofiler_core.pipeline
+import cellprofiler_core.workspace
+import numpy
+import numpy.testing
+
+import enforceobjectsonetoone
+
+instance = enforceobjectsonetoone.EnforceObjectsOneToOne
+
+
+def run_module(module, pre_primary_labels, pre_secondary_labels):
+    """Run the module on the given label images, returning the output primary and secondary labels"""
+    object_set = cellprofiler_core.object.ObjectSet()
+
+    for name, labels in (("Nuclei", pre_primary_labels), ("Cells", pre_secondary_labels)):
+        objects = cellprofiler_core.object.Objects()
+
+        objects.segmented = labels
+
+        object_set.add_objects(objects, name)
+
+    module.x_name.value = "Nuclei"
+
+    module.y_name.value = "Cells"
+
+    module.output_primary_objects_name.value = "Primary"
+
+    module.output_secondary_objects_name.value = "Secondary"
+
+    image_set_list = cellprofiler_core.image.ImageSetList()
+
+    workspace = cellprofiler_core.workspace.Workspace(
+        cellprofiler_core.pipeline.Pipeline(),
+        module,
+        image_set_list.get_image_set(0),
+        object_set,
+        cellprofiler_core.measurement.Measurements(),
+        image_set_list,
+    )
+
+    module.run(workspace)
+
+    return (
+        object_set.get_objects("Primary").segmented,
+        object_set.get_objects("Secondary").segmented,
+    )
+
+
+def match(module, primary_labels, secondary_labels):
+    """The secondary label each primary label is matched to, 0 if none"""
+    _, secondary_matches = module.enforce_unique(primary_labels, secondary_labels)
+
+    return secondary_matches
+
+
+def test_one_to_one(module):
+    # every nucleus touches a single cell and every cell a single nucleus
+    secondary = numpy.zeros((6, 12), int)
+
+    secondary[1:-1, 1:6] = 1
+
+    secondary[1:-1, 6:11] = 2
+
+    primary = numpy.zeros_like(secondary)
+
+    primary[2:4, 1:3] = 2
+
+    primary[2:4, 7:9] = 1
+
+    numpy.testing.assert_array_equal(match(module, primary, secondary), [0, 2, 1])
+
+    primary_labels, secondary_labels = run_module(module, primary, secondary)
+
+    numpy.testing.assert_array_equal(primary_labels, primary)
+
+    numpy.testing.assert_array_equal(secondary_labels, secondary)
+
+
+def test_tie_on_percent_overlap_goes_to_larger_area(module):
+    # both nuclei are entirely inside the cell, so the bigger one wins
+    secondary = numpy.zeros((6, 12), int)
+
+    secondary[1:-1, 1:-1] = 1
+
+    primary = numpy.zeros_like(secondary)
+
+    primary[1:3, 1:3] = 1
+
+    primary[1:5, 6:10] = 2
+
+    numpy.testing.assert_array_equal(match(module, primary, secondary), [0, 0, 1])
+
+
+def test_full_tie_is_not_matched(module):
+    # two identical nuclei entirely inside the same cell, neither gets it
+    secondary = numpy.zeros((6, 12), int)
+
+    secondary[1:-1, 1:-1] = 1
+
+    primary = numpy.zeros_like(secondary)
+
+    primary[1:3, 1:3] = 1
+
+    primary[1:3, 6:8] = 2
+
+    numpy.testing.assert_array_equal(match(module, primary, secondary), [0, 0, 0])
+
+
+def test_percent_overlap_beats_area(module):
+    # nucleus 1 is all inside cell 1; the bigger nucleus 2 is only half inside it,
+    # so cell 1 goes to nucleus 1 and nucleus 2 gets cell 2, which it alone touches
+    secondary = numpy.zeros((6, 12), int)
+
+    secondary[1:-1, 1:6] = 1
+
+    secondary[1:-1, 6:11] = 2
+
+    primary = numpy.zeros_like(secondary)
+
+    primary[1:2, 1:3] = 1
+
+    primary[2:4, 4:8] = 2
+
+    numpy.testing.assert_array_equal(match(module, primary, secondary), [0, 1, 2])
+
+    primary_labels, secondary_labels = run_module(module, primary, secondary)
+
+    # nucleus 2 is eroded to the part inside its cell
+    expected_primary = primary.copy()
+
+    expected_primary[secondary != 2] = numpy.where(
+        expected_primary[secondary != 2] == 1, 1, 0
+    )
+
+    numpy.testing.assert_array_equal(primary_labels, expected_primary)
+
+    numpy.testing.assert_array_equal(secondary_labels, secondary)
+
+
+def test_nucleus_takes_its_largest_won_overlap(module):
+    # nucleus 1 is the only nucleus touching either cell and wins both,
+    # it keeps the cell it overlaps the most
+    secondary = numpy.zeros((6, 12), int)
+
+    secondary[1:-1, 1:6] = 1
+
+    secondary[1:-1, 6:11] = 2
+
+    primary = numpy.zeros_like(secondary)
+
+    primary[2:4, 4:10] = 1
+
+    numpy.testing.assert_array_equal(match(module, primary, secondary), [0, 2])
+
+    primary_labels, secondary_labels = run_module(module, primary, secondary)
+
+    numpy.testing.assert_array_equal(primary_labels, numpy.where(secondary == 2, primary, 0))
+
+    numpy.testing.assert_array_equal(secondary_labels, numpy.where(secondary == 2, 1, 0))
+
+
+def test_nucleus_takes_lowest_label_on_equal_won_overlaps(module):
+    secondary = numpy.zeros((6, 12), int)
+
+    secondary[1:-1, 1:6] = 1
+
+    secondary[1:-1, 6:11] = 2
+
+    primary = numpy.zeros_like(secondary)
+
+    primary[2:4, 3:9] = 1
+
+    numpy.testing.assert_array_equal(match(module, primary, secondary), [0, 1])
+
+
+def test_no_matches(module):
+    # nothing overlaps, so everything is filtered out
+    secondary = numpy.zeros((6, 12), int)
+
+    secondary[1:-1, 1:6] = 1
+
+    primary = numpy.zeros_like(secondary)
+
+    primary[2:4, 8:10] = 1
+
+    primary_labels, secondary_labels = run_module(module, primary, secondary)
+
+    numpy.testing.assert_array_equal(primary_labels, 0)
+
+    numpy.testing.assert_array_equal(secondary_labels, 0)
+
+
+def test_no_background(module):
+    # every pixel is labeled, label 1 must still be considered
+    secondary = numpy.ones((6, 12), int)
+
+    secondary[:, 6:] = 2
+
+    primary = secondary.copy()
+
+    primary_labels, secondary_labels = run_module(module, primary, secondary)
+
+    numpy.testing.assert_array_equal(primary_labels, primary)
+
+    numpy.testing.assert_array_equal(secondary_labels, secondary)
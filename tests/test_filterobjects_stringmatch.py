@@ -0,0 +1,191 @@
+import cellprofiler_core.image
+import cellprofiler_core.measurement
+import cellprofiler_core.object
+import cellprofiler_core.pipeline
+import cellprofiler_core.workspace
+import numpy
+import numpy.testing
+import pytest
+
+import filterobjects_stringmatch
+
+instance = filterobjects_stringmatch.FilterObjects_StringMatch
+
+BARCODES = ["AAAA", "AAAAB", "AAAB", "CCCC", "GAAAA"]
+
+
+def make_workspace(module, barcodes, labels=None, small_removed_labels=None):
+    """Make a workspace with the barcodes measured on the "Spots" objects"""
+    object_set = cellprofiler_core.object.ObjectSet()
+
+    if labels is not None:
+        objects = cellprofiler_core.object.Objects()
+
+        objects.segmented = labels
+
+        if small_removed_labels is not None:
+            objects.small_removed_segmented = small_removed_labels
+
+        object_set.add_objects(objects, "Spots")
+
+    measurements = cellprofiler_core.measurement.Measurements()
+
+    measurements.add_measurement("Spots", "Barcode_BarcodeCalled", numpy.array(barcodes))
+
+    module.x_name.value = "Spots"
+
+    module.y_name.value = "FilteredSpots"
+
+    module.filter_column.value = "Barcode_BarcodeCalled"
+
+    image_set_list = cellprofiler_core.image.ImageSetList()
+
+    return cellprofiler_core.workspace.Workspace(
+        cellprofiler_core.pipeline.Pipeline(),
+        module,
+        image_set_list.get_image_set(0),
+        object_set,
+        measurements,
+        image_set_list,
+    )
+
+
+def set_filter(module, method, filter_out, additional_strings=()):
+    module.filter_method.value = method
+
+    module.filter_out.value = filter_out
+
+    for additional_string in additional_strings:
+        module.add_additional_string()
+
+        module.additional_strings[-1].additional_string.value = additional_string
+
+
+@pytest.mark.parametrize(
+    "method,filter_out,additional_strings,expected",
+    [
+        (filterobjects_stringmatch.METHOD_EXACT, "AAAA", [], [2, 3, 4, 5]),
+        (filterobjects_stringmatch.METHOD_EXACT, "AAAA", ["CCCC", "TTTT"], [2, 3, 5]),
+        (filterobjects_stringmatch.METHOD_CONTAINS, "AAAA", [], [3, 4]),
+        (filterobjects_stringmatch.METHOD_CONTAINS, "AAAA", ["CCCC"], [3]),
+        (filterobjects_stringmatch.METHOD_KEEP_EXACT, "AAAA", [], [1]),
+        (filterobjects_stringmatch.METHOD_KEEP_EXACT, "AAAA", ["CCCC"], [1]),
+        (filterobjects_stringmatch.METHOD_KEEP_CONTAINS, "AAAA", [], [1, 2, 5]),
+        (filterobjects_stringmatch.METHOD_KEEP_CONTAINS, "AAAA", ["B"], [2]),
+        # every string contains the empty string and none is equal to it
+        (filterobjects_stringmatch.METHOD_EXACT, "", [], [1, 2, 3, 4, 5]),
+        (filterobjects_stringmatch.METHOD_CONTAINS, "", [], []),
+        (filterobjects_stringmatch.METHOD_KEEP_EXACT, "", [], []),
+        (filterobjects_stringmatch.METHOD_KEEP_CONTAINS, "", [], [1, 2, 3, 4, 5]),
+        (filterobjects_stringmatch.METHOD_KEEP_CONTAINS, "", ["C"], [4]),
+    ],
+)
+def test_keep_by_string(module, method, filter_out, additional_strings, expected):
+    workspace = make_workspace(module, BARCODES)
+
+    set_filter(module, method, filter_out, additional_strings)
+
+    indexes = module.keep_by_string(workspace, None)
+
+    numpy.testing.assert_array_equal(indexes, expected)
+
+
+def test_keep_by_string_no_objects(module):
+    workspace = make_workspace(module, [])
+
+    set_filter(module, filterobjects_stringmatch.METHOD_CONTAINS, "AAAA")
+
+    indexes = module.keep_by_string(workspace, None)
+
+    assert indexes.shape == (0,)
+
+
+def test_run(module):
+    labels = numpy.zeros((6, 12), int)
+
+    labels[1:3, 1:3] = 1
+
+    labels[1:3, 4:6] = 2
+
+    labels[1:3, 7:9] = 3
+
+    labels[4:6, 1:3] = 4
+
+    labels[4:6, 4:6] = 5
+
+    # an object that was removed for being too small is left alone
+    small_removed_labels = labels.copy()
+
+    small_removed_labels[4:6, 9:11] = 6
+
+    workspace = make_workspace(module, BARCODES, labels, small_removed_labels)
+
+    set_filter(module, filterobjects_stringmatch.METHOD_CONTAINS, "AAAA")
+
+    module.run(workspace)
+
+    target = workspace.object_set.get_objects("FilteredSpots")
+
+    expected = numpy.zeros_like(labels)
+
+    expected[labels == 3] = 1
+
+    expected[labels == 4] = 2
+
+    numpy.testing.assert_array_equal(target.segmented, expected)
+
+    expected_small_removed = small_removed_labels.copy()
+
+    expected_small_removed[numpy.isin(labels, [1, 2, 5])] = 0
+
+    numpy.testing.assert_array_equal(target.small_removed_segmented, expected_small_removed)
+
+    numpy.testing.assert_array_equal(
+        workspace.measurements.get_current_measurement("Spots", "Children_FilteredSpots_Count"),
+        [0, 0, 1, 1, 0],
+    )
+
+    numpy.testing.assert_array_equal(
+        workspace.measurements.get_current_measurement("FilteredSpots", "Parent_Spots"),
+        [3, 4],
+    )
+
+
+def test_run_sparse_labels(module):
+    # the labels are far higher than the number of pixels, so they can't index a lookup table
+    labels = numpy.zeros((4, 8), int)
+
+    labels[1:3, 1:3] = 40
+
+    labels[1:3, 3:5] = 7
+
+    labels[1:3, 5:7] = 1000
+
+    barcodes = numpy.full(1000, "CCCC")
+
+    barcodes[[7 - 1, 1000 - 1]] = "AAAA"
+
+    workspace = make_workspace(module, barcodes, labels)
+
+    set_filter(module, filterobjects_stringmatch.METHOD_EXACT, "AAAA")
+
+    module.run(workspace)
+
+    target = workspace.object_set.get_objects("FilteredSpots")
+
+    expected = numpy.zeros_like(labels)
+
+    # label 40 is the 39th object that is kept, after 1-6 and 8-39
+    expected[labels == 40] = 39
+
+    numpy.testing.assert_array_equal(target.segmented, expected)
+
+    numpy.testing.assert_array_equal(target.small_removed_segmented, labels * (expected > 0))
+
+    parents = workspace.measurements.get_current_measurement("FilteredSpots", "Parent_Spots")
+
+    numpy.testing.assert_array_equal(parents[38], 40)
+
+    children = workspace.measurements.get_current_measurement("Spots", "Children_FilteredSpots_Count")
+
+    numpy.testing.assert_array_equal(children[[7 - 1, 40 - 1, 1000 - 1]], [0, 1, 0])
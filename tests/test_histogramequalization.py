@@ -1,6 +1,7 @@
 import cellprofiler.image
 import numpy
 import numpy.testing
+import pytest
 import skimage.exposure
 
 import histogramequalization
@@ -138,3 +139,159 @@ def test_run_mask(image, image_set, module, workspace):
     )
 
     numpy.testing.assert_array_equal(expected.pixel_data, actual.pixel_data)
+
+
+def test_run_framewise(image, image_set, module, workspace):
+    if not image.volumetric:
+        pytest.skip("Framewise equalization only applies to volumes")
+
+    module.x_name.value = "example"
+
+    module.y_name.value = "HistogramEqualization"
+
+    module.nbins.value = 256
+
+    module.mask.value = "Leave blank"
+
+    module.local.value = False
+
+    module.do_3D.value = True
+
+    module.do_framewise.value = True
+
+    module.run(workspace)
+
+    actual = image_set.get_image("HistogramEqualization")
+
+    data = image.pixel_data
+
+    expected_data = numpy.zeros_like(data)
+
+    for index, plane in enumerate(data):
+        expected_data[index] = skimage.exposure.equalize_hist(plane)
+
+    numpy.testing.assert_allclose(actual.pixel_data, expected_data, rtol=1e-6)
+
+
+def test_run_framewise_mask(image, image_set, module, workspace):
+    if not image.volumetric:
+        pytest.skip("Framewise equalization only applies to volumes")
+
+    data = image.pixel_data
+
+    # a single plane mask is applied to every plane
+    mask_data = numpy.zeros_like(data[0], dtype="bool")
+
+    mask_data[5:-5, 5:-5] = True
+
+    mask = cellprofiler.image.Image(
+        image=mask_data,
+        dimensions=2
+    )
+
+    image_set.add("Mask", mask)
+
+    module.x_name.value = "example"
+
+    module.y_name.value = "HistogramEqualization"
+
+    module.nbins.value = 256
+
+    module.local.value = False
+
+    module.mask.value = "Mask"
+
+    module.do_3D.value = True
+
+    module.do_framewise.value = True
+
+    module.run(workspace)
+
+    actual = image_set.get_image("HistogramEqualization")
+
+    expected_data = numpy.zeros_like(data)
+
+    for index, plane in enumerate(data):
+        expected_data[index] = skimage.exposure.equalize_hist(plane, mask=mask_data)
+
+    numpy.testing.assert_allclose(actual.pixel_data, expected_data, rtol=1e-6)
+
+
+def test_run_framewise_volume_mask(image, image_set, module, workspace):
+    if not image.volumetric:
+        pytest.skip("Framewise equalization only applies to volumes")
+
+    data = image.pixel_data
+
+    # each plane is equalized with its own plane of the mask
+    mask_data = numpy.zeros_like(data, dtype="bool")
+
+    mask_data[0, 5:-5, 5:-5] = True
+
+    mask_data[1, :16, :] = True
+
+    mask = cellprofiler.image.Image(
+        image=mask_data,
+        dimensions=image.dimensions
+    )
+
+    image_set.add("Mask", mask)
+
+    module.x_name.value = "example"
+
+    module.y_name.value = "HistogramEqualization"
+
+    module.nbins.value = 256
+
+    module.local.value = False
+
+    module.mask.value = "Mask"
+
+    module.do_3D.value = True
+
+    module.do_framewise.value = True
+
+    module.run(workspace)
+
+    actual = image_set.get_image("HistogramEqualization")
+
+    expected_data = numpy.zeros_like(data)
+
+    for index, plane in enumerate(data):
+        expected_data[index] = skimage.exposure.equalize_hist(plane, mask=mask_data[index])
+
+    numpy.testing.assert_allclose(actual.pixel_data, expected_data, rtol=1e-6)
+
+
+def test_run_framewise_local(image, image_set, module, workspace):
+    if not image.volumetric:
+        pytest.skip("Framewise equalization only applies to volumes")
+
+    module.x_name.value = "example"
+
+    module.y_name.value = "HistogramEqualization"
+
+    module.nbins.value = 256
+
+    module.local.value = True
+
+    module.tile_size.value = 16
+
+    module.do_3D.value = True
+
+    module.do_framewise.value = True
+
+    module.run(workspace)
+
+    actual = image_set.get_image("HistogramEqualization")
+
+    data = image.pixel_data
+
+    expected_data = numpy.zeros_like(data)
+
+    for index, plane in enumerate(data):
+        expected_data[index] = skimage.exposure.equalize_adapthist(
+            plane, kernel_size=16, clip_limit=module.clip_limit.value
+        )
+
+    numpy.testing.assert_allclose(actual.pixel_data, expected_data, rtol=1e-6)
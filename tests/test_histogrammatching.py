@@ -0,0 +1,76 @@
+import cellprofiler_core.image
+import numpy
+import numpy.testing
+import pytest
+import skimage.data
+import skimage.exposure
+
+import histogrammatching
+
+instance = histogrammatching.HistogramMatching
+
+
+def test_run_self_reference(image, image_set, module, workspace):
+    if not image.volumetric:
+        pytest.skip("Matching to a frame only applies to volumes")
+
+    module.x_name.value = "example"
+
+    module.y_name.value = "HistogramMatching"
+
+    module.do_3D.value = True
+
+    module.do_self_reference.value = True
+
+    module.frame_number.value = 1
+
+    module.run(workspace)
+
+    actual = image_set.get_image("HistogramMatching")
+
+    data = image.pixel_data
+
+    expected_data = numpy.zeros_like(data)
+
+    for index, plane in enumerate(data):
+        expected_data[index] = skimage.exposure.match_histograms(plane, data[1])
+
+    numpy.testing.assert_allclose(actual.pixel_data, expected_data, rtol=1e-6)
+
+
+def test_run_reference_image(image, image_set, module, workspace):
+    if not image.volumetric:
+        pytest.skip("Matching each frame only applies to volumes")
+
+    reference = cellprofiler_core.image.Image(
+        image=skimage.data.camera()[64:96, 64:96],
+        dimensions=2
+    )
+
+    image_set.add("Reference", reference)
+
+    module.x_name.value = "example"
+
+    module.y_name.value = "HistogramMatching"
+
+    module.reference_image.value = "Reference"
+
+    module.do_3D.value = True
+
+    module.do_self_reference.value = False
+
+    module.run(workspace)
+
+    actual = image_set.get_image("HistogramMatching")
+
+    data = image.pixel_data
+
+    # every plane is matched to the reference, not just the last one
+    expected_data = numpy.zeros_like(data)
+
+    for index, plane in enumerate(data):
+        expected_data[index] = skimage.exposure.match_histograms(
+            plane, reference.pixel_data
+        )
+
+    numpy.testing.assert_allclose(actual.pixel_data, expected_data, rtol=1e-6)